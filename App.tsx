@@ -110,6 +110,29 @@ const SetCard: React.FC<{
   );
 };
 
+// Polls between full item reloads (poll runs every second)
+const FULL_SYNC_EVERY = 10;
+
+// Load family items, following the server's keyset pagination (max page size)
+const fetchAllItems = async (userId: number, includeBought: boolean = true): Promise<any[] | null> => {
+  const all: any[] = [];
+  let after: string | null = null;
+  do {
+    const params = new URLSearchParams({
+      user_id: String(userId),
+      limit: '1000',
+      include_bought: String(includeBought)
+    });
+    if (after) params.set('after', after);
+    const res = await fetch(`/api/items?${params}`);
+    if (!res.ok) return null;
+    const page = await res.json();
+    all.push(...page.items);
+    after = page.next;
+  } while (after);
+  return all;
+};
+
 const App: React.FC = () => {
   const [categories, setCategories] = useState<CategoryDef[]>(() => {
     const saved = localStorage.getItem('lumina_categories');
@@ -212,6 +235,10 @@ const App: React.FC = () => {
 
   // Sync lock - prevents polling from overwriting during active operations
   const syncLockRef = useRef<number>(0);
+  // Set when a poll can't tell what happened to an item; next poll reloads everything
+  const needsFullSyncRef = useRef<boolean>(false);
+  // Current family id from the backend, passed to the WebSocket on (re)connect
+  const familyIdRef = useRef<number | null>(null);
 
   // States for Editing/Adding
   const [editingItem, setEditingItem] = useState<ProductItem | null>(null);
@@ -305,19 +332,20 @@ const App: React.FC = () => {
             const joinData = await joinRes.json();
             setFamilyMembers(joinData.family.members.filter((m: any) => m.telegram_id !== tgUser.id));
             setInviteCode(joinData.family.invite_code);
+            familyIdRef.current = joinData.family.id;
             setIsOwner(joinData.family.is_owner || false);
             showToast("Вы присоединились к семье!");
           }
         } else {
           setFamilyMembers(authData.family.members.filter((m: any) => m.telegram_id !== tgUser.id));
           setInviteCode(authData.family.invite_code);
+          familyIdRef.current = authData.family.id;
           setIsOwner(authData.family.is_owner || false);
         }
 
         // Sync Items
-        const itemsRes = await fetch(`/api/items?user_id=${tgUser.id}`);
-        if (itemsRes.ok) {
-          const remoteItems = await itemsRes.json();
+        const remoteItems = await fetchAllItems(tgUser.id);
+        if (remoteItems) {
           // Server is single source of truth - just map and set
           const mappedItems: ProductItem[] = remoteItems.map((ri: any) => ({
             id: ri.id,
@@ -350,7 +378,8 @@ const App: React.FC = () => {
 
     const connect = () => {
       const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-      const wsUrl = `${protocol}//${window.location.host}/ws/${tgUser.id}`;
+      const familyParam = familyIdRef.current !== null ? `?family_id=${familyIdRef.current}` : '';
+      const wsUrl = `${protocol}//${window.location.host}/ws/${tgUser.id}${familyParam}`;
 
       ws = new WebSocket(wsUrl);
 
@@ -415,14 +444,59 @@ const App: React.FC = () => {
   useEffect(() => {
     if (!tgUser || tgUser.id === 0) return;
 
+    let pollCount = 0;
+
     const pollItems = async () => {
       // Skip if sync is in progress
       if (syncLockRef.current > 0) return;
 
       try {
-        const res = await fetch(`/api/items?user_id=${tgUser.id}`);
-        if (res.ok && syncLockRef.current === 0) {
-          const remoteItems = await res.json();
+        // Usually poll only the active (not bought) items. Every FULL_SYNC_EVERY-th
+        // poll reloads everything, so edits/deletes of bought items made elsewhere
+        // (e.g. by this user's other device, which gets no broadcast) show up too
+        pollCount += 1;
+        const fullSync = needsFullSyncRef.current || pollCount % FULL_SYNC_EVERY === 0;
+        const remoteItems = await fetchAllItems(tgUser.id, fullSync);
+        if (remoteItems && syncLockRef.current === 0) {
+          if (!fullSync) {
+            setItems(prev => {
+              const serverMap = new Map(remoteItems.map((ri: any) => [ri.id, ri]));
+              const prevIds = new Set(prev.map(p => p.id));
+
+              // An item we show as active is no longer active on the server: it was
+              // bought or deleted elsewhere, only a full reload can tell which
+              if (prev.some(p => p.onList && !p.completed && !serverMap.has(p.id))) {
+                needsFullSyncRef.current = true;
+              }
+
+              const updated = prev.map(p => {
+                const ri: any = serverMap.get(p.id);
+                return ri ? {
+                  ...p,
+                  name: ri.text,
+                  categoryId: ri.category || 'dept_none',
+                  completed: ri.is_bought,
+                  onList: true,
+                  purchaseCount: ri.purchase_count || 0
+                } : p;
+              });
+              const added = remoteItems
+                .filter((ri: any) => !prevIds.has(ri.id))
+                .map((ri: any) => ({
+                  id: ri.id,
+                  name: ri.text,
+                  categoryId: ri.category || 'dept_none',
+                  completed: ri.is_bought,
+                  onList: true,
+                  purchaseCount: ri.purchase_count || 0
+                }));
+
+              return [...updated, ...added];
+            });
+            return;
+          }
+
+          needsFullSyncRef.current = false;
           // Merge: keep local-only items + update server items
           setItems(prev => {
             const prevMap = new Map(prev.map(p => [p.id, p]));
@@ -1004,6 +1078,7 @@ const App: React.FC = () => {
         const data = await res.json();
         setFamilyMembers([]);
         setInviteCode(data.family.invite_code);
+        familyIdRef.current = data.family.id;
         setIsOwner(true);
         showToast("Вы покинули семью");
       } else {
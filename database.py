@@ -1,10 +1,19 @@
 import os
+import logging
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Set DB_DEBUG=1 to log what was parsed out of DATABASE_URL on startup
+DB_DEBUG = os.getenv("DB_DEBUG") == "1"
+if DB_DEBUG:
+    logging.basicConfig()
+    logger.setLevel(logging.DEBUG)
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 if DATABASE_URL:
@@ -16,26 +25,51 @@ if DATABASE_URL:
     elif DATABASE_URL.startswith("postgresql://"):
         DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
 
-    print(f"DEBUG: Connection URL starts with: {DATABASE_URL.split('://')[0]}://...")
+    if DB_DEBUG:
+        logger.debug("Connection URL starts with: %s://...", DATABASE_URL.split('://')[0])
+        try:
+            from urllib.parse import urlparse
+            # Parsing with a dummy scheme to ensure username/password extraction works even if sqlalchemy differs
+            parsed = urlparse(DATABASE_URL)
+            logger.debug("Detected hostname: '%s'", parsed.hostname)
+            logger.debug("Detected port: '%s'", parsed.port)
+            if parsed.hostname and ('@' in parsed.username if parsed.username else False):
+                logger.warning("Username contains '@'. This might be fine.")
+        except Exception as e:
+            logger.debug("Could not parse URL for debugging: %s", e)
+
+# Set SQL_ECHO=1 to log every statement (debug only, expensive under load)
+SQL_ECHO = os.getenv("SQL_ECHO") == "1"
+
+# Connection modes:
+# - PgBouncer / Supabase pooler (transaction pooling): prepared statements can't
+#   survive across pooled server connections, so asyncpg's statement cache must be
+#   disabled. Enabled with PGBOUNCER=1, or inferred from the pooler ports
+#   (6432 for PgBouncer, 6543 for the Supabase transaction pooler).
+# - Direct Postgres: leave asyncpg's prepared statement cache at its default so
+#   repeated queries skip the parse/bind step.
+def _uses_pgbouncer(url):
+    if os.getenv("PGBOUNCER") is not None:
+        return os.getenv("PGBOUNCER") == "1"
+    if not url:
+        return False
+    from urllib.parse import urlparse
     try:
-        from urllib.parse import urlparse
-        # Parsing with a dummy scheme to ensure username/password extraction works even if sqlalchemy differs
-        parsed = urlparse(DATABASE_URL)
-        print(f"DEBUG: DETECTED HOSTNAME: '{parsed.hostname}'")
-        print(f"DEBUG: DETECTED PORT: '{parsed.port}'")
-        if parsed.hostname and ('@' in parsed.username if parsed.username else False):
-             print("WARNING: Username contains '@'. This might be fine.")
-    except Exception as e:
-        print(f"DEBUG: Could not parse URL for debugging: {e}")
-
-# Fix for Supabase/PgBouncer: Disable prepared statements and enable pre-ping
+        return urlparse(url).port in (6432, 6543)
+    except ValueError:
+        return False
+
+PGBOUNCER = _uses_pgbouncer(DATABASE_URL)
+
 engine = create_async_engine(
-    DATABASE_URL, 
-    echo=True,
+    DATABASE_URL,
+    echo=SQL_ECHO,
+    pool_size=20,
+    max_overflow=10,
+    pool_timeout=30,
     pool_pre_ping=True,
-    connect_args={
-        "statement_cache_size": 0
-    }
+    pool_recycle=1800,
+    connect_args={"statement_cache_size": 0} if PGBOUNCER else {}
 )
 
 AsyncSessionLocal = sessionmaker(
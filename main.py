@@ -1,54 +1,151 @@
-from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Depends, HTTPException, Query, status, WebSocket, WebSocketDisconnect
 from datetime import datetime
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import text
+from sqlalchemy import text, func, delete, exists, literal, true
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import selectinload
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from pydantic import BaseModel
-from typing import List, Optional, Dict
+from typing import Awaitable, Callable, Optional, Dict, Set, TypeVar
 import os
 import json
+import asyncio
+import orjson
+from cachetools import TTLCache
 
 from database import get_db, engine, Base
-from models import User, Family, Item
+from models import User, Family, Item, generate_invite_code
 
 # WebSocket Connection Manager for real-time sync
+SEND_TIMEOUT = 2.0  # seconds per socket when broadcasting
+
 class ConnectionManager:
     def __init__(self):
-        # Map family_id -> list of (user_id, websocket)
-        self.active_connections: Dict[int, List[tuple]] = {}
+        # Map family_id -> {user_id: set of websockets}; a user may be online from several devices
+        self.active_connections: Dict[int, Dict[int, Set[WebSocket]]] = {}
+        # Background close tasks, referenced so they aren't garbage collected mid-flight
+        self._closing: Set[asyncio.Task] = set()
     
     async def connect(self, websocket: WebSocket, user_id: int, family_id: int):
         await websocket.accept()
-        if family_id not in self.active_connections:
-            self.active_connections[family_id] = []
-        self.active_connections[family_id].append((user_id, websocket))
-    
-    def disconnect(self, user_id: int, family_id: int):
-        if family_id in self.active_connections:
-            self.active_connections[family_id] = [
-                (uid, ws) for uid, ws in self.active_connections[family_id] 
-                if uid != user_id
-            ]
-            if not self.active_connections[family_id]:
-                del self.active_connections[family_id]
+        self.active_connections.setdefault(family_id, {}).setdefault(user_id, set()).add(websocket)
+    
+    def disconnect(self, user_id: int, family_id: int, websocket: WebSocket):
+        conns = self.active_connections.get(family_id)
+        if not conns:
+            return
+        sockets = conns.get(user_id)
+        if sockets is not None:
+            sockets.discard(websocket)
+            if not sockets:
+                del conns[user_id]
+        if not conns:
+            del self.active_connections[family_id]
     
     async def broadcast_to_family(self, family_id: int, message: dict, exclude_user_id: int = None):
         """Broadcast message to all family members except the sender"""
         if family_id not in self.active_connections:
             return
-        for uid, ws in self.active_connections[family_id]:
-            if uid != exclude_user_id:
-                try:
-                    await ws.send_json(message)
-                except:
-                    pass  # Connection might be closed
+        recipients = [
+            (uid, ws)
+            for uid, sockets in self.active_connections[family_id].items()
+            if uid != exclude_user_id
+            for ws in sockets
+        ]
+        # Encode once for all recipients; sent as a text frame since clients JSON.parse it
+        payload = orjson.dumps(message).decode()
+        # Send in parallel so one slow client doesn't stall the rest
+        results = await asyncio.gather(
+            *(asyncio.wait_for(ws.send_text(payload), SEND_TIMEOUT) for _, ws in recipients),
+            return_exceptions=True,
+        )
+        # Drop sockets that failed or timed out (connection is likely dead, or a
+        # frame was cut off mid-send) and close them so the client reconnects
+        for (uid, ws), result in zip(recipients, results):
+            if isinstance(result, Exception):
+                self.disconnect(uid, family_id, ws)
+                task = asyncio.create_task(self._close_quietly(ws))
+                self._closing.add(task)
+                task.add_done_callback(self._closing.discard)
+
+    @staticmethod
+    async def _close_quietly(websocket: WebSocket):
+        try:
+            await websocket.close(code=1011)
+        except Exception:
+            pass  # Connection might be closed already
 
 manager = ConnectionManager()
 
-app = FastAPI()
+# telegram_id -> family_id for reads (GET /api/items) and WebSocket connects.
+# Writes resolve the family inside their own statement instead.
+# Invalidated by the endpoints that move users between families, but only in the
+# process that handled them, so the cache is only used with a single worker
+# (WEB_CONCURRENCY=1); with more workers every lookup goes to the database.
+family_cache: TTLCache = TTLCache(maxsize=50_000, ttl=30)
+FAMILY_CACHE_ENABLED = int(os.getenv("WEB_CONCURRENCY", "1")) == 1
+
+async def get_family_id(db: AsyncSession, user_id: int) -> Optional[int]:
+    """Return user's family_id (None if user doesn't exist), cached per process"""
+    family_id = family_cache.get(user_id) if FAMILY_CACHE_ENABLED else None
+    if family_id is not None:
+        return family_id
+    result = await db.execute(select(User.family_id).where(User.telegram_id == user_id))
+    family_id = result.scalar_one_or_none()
+    if family_id is not None and FAMILY_CACHE_ENABLED:
+        family_cache[user_id] = family_id
+    return family_id
+
+INVITE_CODE_ATTEMPTS = 5
+# Unique index created for Family.invite_code (unique=True, index=True)
+INVITE_CODE_CONSTRAINT = "ix_families_invite_code"
+
+T = TypeVar("T")
+
+async def retry_invite_code_collisions(db: AsyncSession, run: Callable[[], Awaitable[T]]) -> T:
+    """Run a family-creating step, retrying on an invite_code collision.
+    Each attempt runs in a savepoint, so a collision only rolls back that attempt
+    and run() is called again, generating a fresh code."""
+    for attempt in range(INVITE_CODE_ATTEMPTS):
+        try:
+            async with db.begin_nested():
+                return await run()
+        except IntegrityError as e:
+            # Anything else (e.g. users_pkey when two first logins race) won't go
+            # away with a new code
+            if not _is_invite_code_collision(e) or attempt == INVITE_CODE_ATTEMPTS - 1:
+                raise
+
+def _is_invite_code_collision(e: IntegrityError) -> bool:
+    # The asyncpg error carrying constraint_name is the DBAPI error's cause
+    orig = e.orig
+    constraint = getattr(orig, "constraint_name", None) or getattr(orig.__cause__, "constraint_name", None)
+    return constraint == INVITE_CODE_CONSTRAINT
+
+async def add_with_new_invite_code(db: AsyncSession, make: Callable[[], T]) -> T:
+    """Add and flush the object built by make() (a new Family), retrying on collision"""
+    async def add():
+        obj = make()
+        db.add(obj)
+        return obj
+    return await retry_invite_code_collisions(db, add)
+
+# Family and its owner inserted in one statement (and one round-trip)
+CREATE_USER_WITH_FAMILY = text("""
+    WITH f AS (
+        INSERT INTO families (invite_code, owner_id) VALUES (:invite_code, :telegram_id)
+        RETURNING id
+    )
+    INSERT INTO users (telegram_id, username, photo_url, family_id, last_seen, visit_count)
+    SELECT :telegram_id, :username, :photo_url, f.id, :last_seen, 1 FROM f
+    RETURNING family_id
+""")
+
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # CORS
 origins = ["*"]  # For development; restrict in production
@@ -87,8 +184,7 @@ class ItemUpdate(BaseModel):
 
 # Routes
 
-@app.on_event("startup")
-async def startup():
+async def run_migrations():
     # 1. Create tables if they don't exist
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
@@ -96,12 +192,14 @@ async def startup():
     # 2. Separate migration steps for new columns
     try:
         async with engine.connect() as conn:
-            # Add last_seen column if not exists
-            await conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS last_seen TIMESTAMP WITHOUT TIME ZONE;"))
+            # Add last_seen and visit_count columns if not exist
+            await conn.execute(text(
+                "ALTER TABLE users "
+                "ADD COLUMN IF NOT EXISTS last_seen TIMESTAMP WITHOUT TIME ZONE, "
+                "ADD COLUMN IF NOT EXISTS visit_count INTEGER DEFAULT 0;"
+            ))
             # Add owner_id column if not exists
             await conn.execute(text("ALTER TABLE families ADD COLUMN IF NOT EXISTS owner_id BIGINT;"))
-            # Add visit_count column if not exists
-            await conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS visit_count INTEGER DEFAULT 0;"))
             # Add purchase_count column to items if not exists
             await conn.execute(text("ALTER TABLE items ADD COLUMN IF NOT EXISTS purchase_count INTEGER DEFAULT 0;"))
             await conn.commit()
@@ -109,30 +207,85 @@ async def startup():
         # Ignore error if columns exist or other non-critical migration issue
         print(f"Migration warning (non-critical): {e}")
 
+    # 3. Indexes for existing tables (create_all only indexes new tables).
+    # CONCURRENTLY can't run inside a transaction, hence AUTOCOMMIT; each step is
+    # tried on its own so one failure doesn't skip the rest.
+    index_steps = [
+        ("ix_items_family_id_id", "CREATE INDEX CONCURRENTLY ix_items_family_id_id ON items (family_id, id);"),
+        # Superseded by ix_items_family_id_id
+        ("ix_items_family_id", None),
+        ("ix_users_family_id", "CREATE INDEX CONCURRENTLY ix_users_family_id ON users (family_id);"),
+        # items.text is never filtered on, so its index only slows down writes
+        ("ix_items_text", None),
+    ]
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        for name, create_sql in index_steps:
+            try:
+                if create_sql is None:
+                    await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name};"))
+                    continue
+                # An interrupted concurrent build leaves an INVALID index behind that
+                # IF NOT EXISTS would skip forever, so rebuild it
+                result = await conn.execute(
+                    text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(CAST(:name AS text))"),
+                    {"name": name},
+                )
+                is_valid = result.scalar_one_or_none()
+                if is_valid:
+                    continue
+                if is_valid is False:
+                    await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name};"))
+                await conn.execute(text(create_sql))
+            except Exception as e:
+                print(f"Index migration warning for {name} (non-critical): {e}")
+
+@app.on_event("startup")
+async def startup():
+    # `python main.py` migrates once before starting the workers (unless
+    # RUN_MIGRATIONS=0). When the app is served some other way (e.g. `uvicorn main:app`),
+    # opt in with RUN_MIGRATIONS=1; every worker shares the environment, so only do
+    # that with a single worker
+    if os.getenv("RUN_MIGRATIONS") == "1":
+        await run_migrations()
+
 @app.post("/api/auth")
 async def auth_user(user_data: UserAuth, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(User).where(User.telegram_id == user_data.id))
+    # Load user with family and family members in one go
+    result = await db.execute(
+        select(User)
+        .where(User.telegram_id == user_data.id)
+        .options(selectinload(User.family).selectinload(Family.users))
+    )
     user = result.scalar_one_or_none()
     
     current_time = datetime.utcnow()
 
     if not user:
         # Create new family for new user (user becomes owner)
-        new_family = Family(owner_id=user_data.id)
-        db.add(new_family)
-        await db.commit()
-        await db.refresh(new_family)
-
-        user = User(
-            telegram_id=user_data.id,
-            username=user_data.username,
-            photo_url=user_data.photo_url,
-            family_id=new_family.id,
-            last_seen=current_time,
-            visit_count=1
-        )
-        db.add(user)
+        invite_code = None
+
+        async def create():
+            nonlocal invite_code
+            invite_code = generate_invite_code()
+            result = await db.execute(CREATE_USER_WITH_FAMILY, {
+                "invite_code": invite_code,
+                "telegram_id": user_data.id,
+                "username": user_data.username,
+                "photo_url": user_data.photo_url,
+                "last_seen": current_time,
+            })
+            return result.scalar_one()
+
+        family_id = await retry_invite_code_collisions(db, create)
         await db.commit()
+
+        owner_id = user_data.id
+        members = [{
+            "telegram_id": user_data.id,
+            "username": user_data.username,
+            "photo_url": user_data.photo_url
+        }]
     else:
         # Update user info if changed
         if user.username != user_data.username:
@@ -146,42 +299,37 @@ async def auth_user(user_data: UserAuth, db: AsyncSession = Depends(get_db)):
         # Update last_seen
         user.last_seen = current_time
         await db.commit()
-    
-    # Reload user with family and family members
-    result = await db.execute(
-        select(User)
-        .where(User.telegram_id == user_data.id)
-        .options(selectinload(User.family).selectinload(Family.users))
-    )
-    user = result.scalar_one()
-    
-    # Determine if current user is the family owner
-    is_owner = user.family.owner_id == user.telegram_id
-    
-    # Serialize the response properly
-    return {
+
+        family_id = user.family.id
+        invite_code = user.family.invite_code
+        owner_id = user.family.owner_id
+        members = [
+            {
+                "telegram_id": m.telegram_id,
+                "username": m.username,
+                "photo_url": m.photo_url
+            }
+            for m in user.family.users
+        ]
+    
+    # Serialize the response properly (ORJSONResponse skips jsonable_encoder)
+    return ORJSONResponse({
         "status": "ok", 
         "user": {
-            "telegram_id": user.telegram_id,
-            "username": user.username,
-            "photo_url": user.photo_url,
-            "family_id": user.family_id,
+            "telegram_id": user_data.id,
+            "username": user_data.username,
+            "photo_url": user_data.photo_url,
+            "family_id": family_id,
         },
         "family": {
-            "id": user.family.id,
-            "invite_code": user.family.invite_code,
-            "owner_id": user.family.owner_id,
-            "is_owner": is_owner,
-            "members": [
-                {
-                    "telegram_id": m.telegram_id,
-                    "username": m.username,
-                    "photo_url": m.photo_url
-                }
-                for m in user.family.users
-            ]
+            "id": family_id,
+            "invite_code": invite_code,
+            "owner_id": owner_id,
+            # Determine if current user is the family owner
+            "is_owner": owner_id == user_data.id,
+            "members": members
         }
-    }
+    })
 
 @app.get("/api/admin/stats")
 async def admin_stats(admin_user_id: int, db: AsyncSession = Depends(get_db)):
@@ -196,28 +344,39 @@ async def admin_stats(admin_user_id: int, db: AsyncSession = Depends(get_db)):
     if not requester or requester.username != "v_chernyshov":
          raise HTTPException(status_code=403, detail="Access denied")
 
-    # Fetch all users
-    result = await db.execute(select(User).options(selectinload(User.family)))
-    users = result.scalars().all()
-    
-    stats = []
-    for u in users:
-        is_online = False
-        if u.last_seen:
-             # Consider online if seen in last 5 minutes
-             is_online = (datetime.utcnow() - u.last_seen).total_seconds() < 300
-             
-        stats.append({
+    # Fetch only the columns we need; online status is computed in SQL.
+    # last_seen is stored as naive UTC, so compare against now() in UTC.
+    # Consider online if seen in last 5 minutes
+    is_online = func.coalesce(
+        func.timezone("utc", func.now()) - User.last_seen < text("interval '5 minutes'"),
+        False,
+    ).label("is_online")
+    result = await db.execute(
+        select(
+            User.telegram_id,
+            User.username,
+            User.photo_url,
+            User.last_seen,
+            User.family_id,
+            User.visit_count,
+            is_online,
+        )
+    )
+    
+    # Returned as ORJSONResponse directly to skip FastAPI's jsonable_encoder pass;
+    # orjson serializes last_seen (datetime) natively
+    return ORJSONResponse([
+        {
             "id": u.telegram_id,
             "username": u.username,
             "photo_url": u.photo_url,
-            "last_seen": u.last_seen.isoformat() if u.last_seen else None,
-            "is_online": is_online,
+            "last_seen": u.last_seen,
+            "is_online": u.is_online,
             "family_id": u.family_id,
             "visit_count": u.visit_count or 0
-        })
-        
-    return stats
+        }
+        for u in result.all()
+    ])
 
 @app.post("/api/join")
 async def join_family(join_req: JoinRequest, db: AsyncSession = Depends(get_db)):
@@ -237,6 +396,7 @@ async def join_family(join_req: JoinRequest, db: AsyncSession = Depends(get_db))
 
     user.family_id = family.id
     await db.commit()
+    family_cache.pop(join_req.user_id, None)
     
     # Get Updated Members
     members_result = await db.execute(select(User).where(User.family_id == family.id))
@@ -276,14 +436,13 @@ async def leave_family(leave_req: LeaveRequest, db: AsyncSession = Depends(get_d
     old_family_id = user.family_id
     
     # Create new family for the user (user becomes owner)
-    new_family = Family(owner_id=leave_req.user_id)
-    db.add(new_family)
-    await db.commit()
-    await db.refresh(new_family)
+    # Flushed within the same transaction, which assigns new_family.id
+    new_family = await add_with_new_invite_code(db, lambda: Family(owner_id=leave_req.user_id))
     
     # Move user to new family
     user.family_id = new_family.id
     await db.commit()
+    family_cache.pop(leave_req.user_id, None)
     
     # If old family is now empty, we could delete it (optional cleanup)
     # For now we leave it as is
@@ -342,14 +501,13 @@ async def remove_member(remove_req: RemoveMemberRequest, db: AsyncSession = Depe
         raise HTTPException(status_code=400, detail="User is not in your family")
     
     # Create new family for removed user
-    new_family = Family(owner_id=remove_req.target_user_id)
-    db.add(new_family)
-    await db.commit()
-    await db.refresh(new_family)
+    # Flushed within the same transaction, which assigns new_family.id
+    new_family = await add_with_new_invite_code(db, lambda: Family(owner_id=remove_req.target_user_id))
     
     # Move target user to new family
     target_user.family_id = new_family.id
     await db.commit()
+    family_cache.pop(remove_req.target_user_id, None)
     
     # Get updated members of owner's family
     members_result = await db.execute(select(User).where(User.family_id == owner.family_id))
@@ -374,66 +532,89 @@ async def remove_member(remove_req: RemoveMemberRequest, db: AsyncSession = Depe
     }
 
 @app.get("/api/items")
-async def get_items(user_id: int, db: AsyncSession = Depends(get_db)):
-    # Get user to find family
-    result = await db.execute(select(User).where(User.telegram_id == user_id))
-    user = result.scalar_one_or_none()
-    
-    if not user:
+async def get_items(
+    user_id: int,
+    after: Optional[str] = None,
+    limit: int = Query(200, ge=1, le=1000),
+    include_bought: bool = True,
+    db: AsyncSession = Depends(get_db),
+):
+    """Page through family items ordered by id; pass the returned `next` as `after`."""
+    # Get user's family
+    family_id = await get_family_id(db, user_id)
+    
+    if family_id is None:
         raise HTTPException(status_code=404, detail="User not found")
         
-    items_result = await db.execute(select(Item).where(Item.family_id == user.family_id))
+    stmt = select(Item).where(
+        Item.family_id == family_id,
+        true() if include_bought else Item.is_bought == False,
+    )
+    if after is not None:
+        stmt = stmt.where(Item.id > after)
+    items_result = await db.execute(stmt.order_by(Item.id).limit(limit))
     items = items_result.scalars().all()
     
     # Serialize items
-    return [
-        {
-            "id": item.id,
-            "text": item.text,
-            "is_bought": item.is_bought,
-            "category": item.category,
-            "purchase_count": item.purchase_count or 0
-        }
-        for item in items
-    ]
+    return {
+        "items": [
+            {
+                "id": item.id,
+                "text": item.text,
+                "is_bought": item.is_bought,
+                "category": item.category,
+                "purchase_count": item.purchase_count or 0
+            }
+            for item in items
+        ],
+        # A full page means there may be more
+        "next": items[-1].id if len(items) == limit else None,
+    }
 
 @app.post("/api/items")
 async def create_or_update_item(item_data: ItemCreate, db: AsyncSession = Depends(get_db)):
-    # Get user to find family
-    result = await db.execute(select(User).where(User.telegram_id == item_data.user_id))
-    user = result.scalar_one_or_none()
+    # Create or update in one atomic statement. The user's family is read in the
+    # same statement (never from the cache), so a write can't land in a family
+    # the user just left; no row comes back if the user doesn't exist.
+    stmt = pg_insert(Item).from_select(
+        ["id", "text", "is_bought", "category", "family_id", "purchase_count"],
+        select(
+            literal(item_data.id),
+            literal(item_data.text),
+            literal(item_data.is_bought),
+            literal(item_data.category),
+            User.family_id,
+            literal(item_data.purchase_count or 0),
+        ).where(User.telegram_id == item_data.user_id)
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Item.id],
+        set_={
+            "text": stmt.excluded.text,
+            "is_bought": stmt.excluded.is_bought,
+            "category": stmt.excluded.category,
+            # Keep the stored count unless a non-zero one was sent
+            "purchase_count": func.coalesce(
+                func.nullif(stmt.excluded.purchase_count, 0), Item.purchase_count
+            ),
+        },
+    ).returning(
+        Item.family_id,
+        text("(xmax = 0) AS inserted"),  # xmax is 0 only for freshly inserted rows
+    )
+    result = await db.execute(stmt)
+    row = result.first()
     
-    if not user:
+    if row is None:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Check if item exists
-    item_result = await db.execute(select(Item).where(Item.id == item_data.id))
-    existing_item = item_result.scalar_one_or_none()
-
-    if existing_item:
-        # Update
-        existing_item.text = item_data.text
-        existing_item.is_bought = item_data.is_bought
-        existing_item.category = item_data.category
-        existing_item.purchase_count = item_data.purchase_count or existing_item.purchase_count
-        action = "item_updated"
-    else:
-        # Create
-        new_item = Item(
-            id=item_data.id,
-            text=item_data.text,
-            is_bought=item_data.is_bought,
-            category=item_data.category,
-            family_id=user.family_id,
-            purchase_count=item_data.purchase_count or 0
-        )
-        db.add(new_item)
-        action = "item_added"
+    family_id = row.family_id
+    action = "item_added" if row.inserted else "item_updated"
     
     await db.commit()
     
     # Broadcast to family members
-    await manager.broadcast_to_family(user.family_id, {
+    await manager.broadcast_to_family(family_id, {
         "type": action,
         "item": {
             "id": item_data.id,
@@ -447,46 +628,51 @@ async def create_or_update_item(item_data: ItemCreate, db: AsyncSession = Depend
 
 @app.delete("/api/items/{item_id}")
 async def delete_item(item_id: str, user_id: int, db: AsyncSession = Depends(get_db)):
-    # Verify user belongs to the family of the item
-    # Fetch item
-    item_result = await db.execute(select(Item).where(Item.id == item_id))
-    item = item_result.scalar_one_or_none()
-    
-    if not item:
-        return {"status": "not found"} # Idempotent
+    # Delete only if user belongs to the family of the item, in one statement
+    user_family_id = (
+        select(User.family_id)
+        .where(User.telegram_id == user_id)
+        .scalar_subquery()
+    )
+    result = await db.execute(
+        delete(Item)
+        .where(Item.id == item_id, Item.family_id == user_family_id)
+        .returning(Item.family_id)
+    )
+    family_id = result.scalar_one_or_none()
+    await db.commit()
 
-    # Fetch user
-    user_result = await db.execute(select(User).where(User.telegram_id == user_id))
-    user = user_result.scalar_one_or_none()
+    if family_id is None:
+        # Nothing deleted: tell missing item apart from foreign item
+        exists_result = await db.execute(select(exists().where(Item.id == item_id)))
+        if not exists_result.scalar():
+            return {"status": "not found"} # Idempotent
+        raise HTTPException(status_code=403, detail="Not authorized")
 
-    if user and user.family_id == item.family_id:
-        family_id = item.family_id
-        await db.delete(item)
-        await db.commit()
-        
-        # Broadcast deletion to family
-        await manager.broadcast_to_family(family_id, {
-            "type": "item_deleted",
-            "item_id": item_id
-        }, exclude_user_id=user_id)
-        
-        return {"status": "deleted"}
+    # Broadcast deletion to family
+    await manager.broadcast_to_family(family_id, {
+        "type": "item_deleted",
+        "item_id": item_id
+    }, exclude_user_id=user_id)
     
-    raise HTTPException(status_code=403, detail="Not authorized")
+    return {"status": "deleted"}
 
 # WebSocket endpoint for real-time sync
 @app.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: int):
-    # Get user's family_id from database
+async def websocket_endpoint(websocket: WebSocket, user_id: int, family_id: Optional[int] = None):
+    # family_id comes from /api/auth on the client; if it disagrees with the
+    # cache, one of them is stale, so re-check the database
+    if family_id is not None and family_cache.get(user_id) != family_id:
+        family_cache.pop(user_id, None)
+
+    # Get user's family_id (session only touches the database on a cache miss)
     from database import AsyncSessionLocal
     
     async with AsyncSessionLocal() as db:
-        result = await db.execute(select(User).where(User.telegram_id == user_id))
-        user = result.scalar_one_or_none()
-        if not user:
-            await websocket.close(code=4001)
-            return
-        family_id = user.family_id
+        family_id = await get_family_id(db, user_id)
+    if family_id is None:
+        await websocket.close(code=4001)
+        return
     
     await manager.connect(websocket, user_id, family_id)
     try:
@@ -497,14 +683,35 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int):
             if data == "ping":
                 await websocket.send_text("pong")
     except WebSocketDisconnect:
-        manager.disconnect(user_id, family_id)
+        manager.disconnect(user_id, family_id, websocket)
     except Exception as e:
         print(f"WebSocket error for user {user_id}: {e}")
-        manager.disconnect(user_id, family_id)
+        manager.disconnect(user_id, family_id, websocket)
 
-# Serve SPA
-app.mount("/", StaticFiles(directory="dist", html=True), name="static")
+# Serve SPA from Python only when asked (single-container/dev); in production
+# nginx serves dist/ and proxies /api and /ws here (see nginx.conf)
+if os.getenv("SERVE_STATIC") == "1":
+    app.mount("/", StaticFiles(directory="dist", html=True), name="static")
 
 if __name__ == "__main__":
+    import sys
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+
+    # Migrate once here rather than in every worker's startup hook;
+    # RUN_MIGRATIONS=0 skips it (e.g. when migrations are run separately)
+    if os.getenv("RUN_MIGRATIONS") != "0":
+        async def migrate():
+            await run_migrations()
+            await engine.dispose()  # don't carry pooled connections over to the server's loop
+        asyncio.run(migrate())
+
+    # uvloop/httptools are the C event loop and HTTP parser; uvloop has no Windows build.
+    # Passing the app as an import string lets WEB_CONCURRENCY > 1 spawn workers.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+    )
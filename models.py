@@ -1,10 +1,11 @@
-from sqlalchemy import Column, Integer, String, BigInteger, ForeignKey, Boolean, DateTime
+from sqlalchemy import Column, Integer, String, BigInteger, ForeignKey, Boolean, DateTime, Index
 from sqlalchemy.orm import relationship
 from database import Base
-import uuid
+import secrets
 
 def generate_invite_code():
-    return str(uuid.uuid4())[:8]
+    # 6 random bytes -> 8 URL-safe chars
+    return secrets.token_urlsafe(6)
 
 class Family(Base):
     __tablename__ = "families"
@@ -22,7 +23,7 @@ class User(Base):
     telegram_id = Column(BigInteger, primary_key=True, index=True)
     username = Column(String, nullable=True)
     photo_url = Column(String, nullable=True)
-    family_id = Column(Integer, ForeignKey("families.id"))
+    family_id = Column(Integer, ForeignKey("families.id"), index=True)
     last_seen = Column(DateTime, nullable=True)
     visit_count = Column(Integer, default=0)
 
@@ -32,10 +33,13 @@ class Item(Base):
     __tablename__ = "items"
 
     id = Column(String, primary_key=True, index=True) # Keeping string ID to match frontend UUID usage
-    text = Column(String, index=True)
+    text = Column(String)
     is_bought = Column(Boolean, default=False)
     category = Column(String, default="dept_none")
     family_id = Column(Integer, ForeignKey("families.id"))
     purchase_count = Column(Integer, default=0)
 
     family = relationship("Family", back_populates="items")
+
+    # Serves both family filtering and keyset pagination by id
+    __table_args__ = (Index("ix_items_family_id_id", "family_id", "id"),)